@@ -0,0 +1,60 @@
+#
+# This file is part of the wwpump distribution
+# Copyright (c) 2022 Martin Köhler.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Benchmark of the timetable (runs on the board and with CPython)
+import time, os
+import ulogging
+import timetable
+try:
+    ticks_us, ticks_diff = time.ticks_us, time.ticks_diff
+except AttributeError: # CPython
+    ticks_us = lambda: time.perf_counter_ns() // 1000
+    ticks_diff = lambda a, b: a - b
+BENCH_FILENAME = "bench_timetable"
+RUNS = 200
+COOLDOWN = 30 * 60 # (s) For plan and next_alarm with cooldown
+def bench(name, func, runs=RUNS):
+    start = ticks_us()
+    for i in range(runs):
+        func(i)
+    print(f"{name:45}: {ticks_diff(ticks_us(), start) / runs:10.1f} us")
+def run(slot_time, used, day_types=timetable.DAY_TYPES):
+    """
+    Benchmark a timetable with slot_time where every used-th slot is set
+    """
+    ttable = timetable.Timetable(slot_time=slot_time, day_types=day_types)
+    ttable.clear()
+    week = timetable.WEEK_MINUTES * 60
+    step = slot_time * 60
+    t0 = 4 * 24 * 60 * 60 # Mon 5.1.1970 00:00
+    for i in range(0, ttable.week_slots, used):
+        ttable.check_item(t0 + i * step + 1)
+    name = f"{slot_time} min, {ttable.templates} days, {len(ttable)} slots"
+    bench(f"{name}: check_item", lambda i: ttable.check_item(t0 + (i * 7919) % week))
+    bench(f"{name}: next_alarm", lambda i: ttable.next_alarm(t0 + (i * 7919) % week))
+    def plan(i):
+        ttable.runs = None # Drop the cached plan
+        ttable.plan(COOLDOWN)
+    bench(f"{name}: plan", plan, runs=10)
+    bench(f"{name}: next_alarm (cooldown)", lambda i: ttable.next_alarm(t0 + (i * 7919) % week, cooldown=COOLDOWN))
+    bench(f"{name}: write_todisk", lambda i: ttable.write_todisk(BENCH_FILENAME), runs=10)
+    bench(f"{name}: read_fromdisk", lambda i: ttable.read_fromdisk(BENCH_FILENAME), runs=10)
+    os.remove(BENCH_FILENAME)
+ulogging.basicConfig(level=ulogging.ERROR)
+run(timetable.SLOT_TIME, 20) # Sparse, as learned by a household
+run(1, 60) # Sparse with 1 min slots
+run(1, 1) # Dense: every minute of the week
+run(1, 1, (0, 0, 0, 0, 0, 1, 2)) # Dense with weekday/Saturday/Sunday templates
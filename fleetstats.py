@@ -0,0 +1,324 @@
+#
+# This file is part of the wwpump distribution
+# Copyright (c) 2022 Martin Köhler.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Host side tool (CPython, not for the board!)
+# Collects wwpumpe.log and timetable files of many boards and builds
+# per board and fleet statistics.
+#
+# Usage: python3 fleetstats.py STORE BOARD_DIR [BOARD_DIR ...]
+#
+# Every BOARD_DIR contains the files copied from one board (wwpumpe.log, timetable).
+# The name of the directory is used as name of the board.
+# The events are kept in STORE/<board>/ as columns of fixed size binary values
+# (ts.bin, ev.bin) that are memory mapped for the evaluation.
+# Only the bytes appended to a log since the last run are parsed. The state (offset in the log,
+# number of events in the columns) is saved after every chunk, an interrupted run is continued.
+# The state also holds the last timetable and the slot drift summed up over all runs.
+import array, ast, calendar, json, mmap, os, re, sys
+from concurrent.futures import ProcessPoolExecutor
+LOG_FILENAME = "wwpumpe.log"
+TIMETABLE_FILENAME = "timetable"
+TIMETABLE_MAGIC = b"TT2" # See timetable.py
+TIMETABLE_MAGIC_V1 = b"TT1"
+STATE_FILENAME = "state.json"
+FLEET_NAME = "fleet"
+WEEK_MINUTES = 7 * 24 * 60
+DAYS = ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
+# Columns: name, array typecode
+COLUMNS = (("ts", "q"), ("ev", "B"))
+# Events (the learned slots are taken from the timetable files)
+EV_DEMAND = 1
+EV_PUMP_ON = 2
+EV_PUMP_OFF = 3
+EV_HOLIDAY_ON = 4
+EV_HOLIDAY_OFF = 5
+# Format of timetable.pt(): dd.mm.yyyy hh:mm:ss
+TIME_RE = re.compile(rb"(\d\d)\.(\d\d)\.(\d{4}) (\d\d):(\d\d):(\d\d): (.*)")
+MESSAGES = (
+    (b"Warm water request detected", EV_DEMAND),
+    (b"Pump on", EV_PUMP_ON),
+    (b"Pump off", EV_PUMP_OFF),
+    (b"Entering holiday mode", EV_HOLIDAY_ON),
+    (b"Leaving holiday mode", EV_HOLIDAY_OFF),
+)
+# Helper functions
+# ======================================
+def minute_of_week(ts):
+    """
+    Minute of the week (Mon 00:00 == 0) of a ts as stored in the event store
+    """
+    # 1.1.1970 was a Thursday
+    return (ts // 60 + 3 * 24 * 60) % WEEK_MINUTES
+def format_minute(mow):
+    """
+    Human readable form of a minute of the week
+    """
+    return f"{DAYS[mow // 1440]} {mow % 1440 // 60:02}:{mow % 60:02}"
+def parse_line(line):
+    """
+    Returns (ts, event) for a line of the log or None if not of interest.
+    ts is the local time of the board in s (without any time zone)
+    """
+    match = TIME_RE.search(line)
+    if match is None:
+        return None
+    d, mm, y, h, m, s = [int(i) for i in match.groups()[0:6]]
+    msg = match.group(7)
+    for text, ev in MESSAGES:
+        if msg.startswith(text):
+            break
+    else:
+        return None
+    try:
+        ts = calendar.timegm((y, mm, d, h, m, s, 0, 0, 0))
+    except (ValueError, OverflowError):
+        return None
+    return ts, ev
+def read_timetable(name):
+    """
+    Reads the slots (as minute of the week) from a timetable file
+    (binary formats or the old list of [wday,h,m,s,cnt])
+    """
+    try:
+        with open(name, "rb") as f:
+            data = f.read()
+        if data.startswith(TIMETABLE_MAGIC):
+            slot_time = data[len(TIMETABLE_MAGIC)]
+            day_types = data[len(TIMETABLE_MAGIC) + 1:len(TIMETABLE_MAGIC) + 8]
+            counters = data[len(TIMETABLE_MAGIC) + 8:]
+            spd = 1440 // slot_time
+            return [wd * 1440 + i * slot_time for wd in range(7) for i in range(spd)
+                    if counters[day_types[wd] * spd + i]]
+        if data.startswith(TIMETABLE_MAGIC_V1):
+            slot_time = data[len(TIMETABLE_MAGIC_V1)]
+            counters = data[len(TIMETABLE_MAGIC_V1) + 1:]
+            return [i * slot_time for i in range(len(counters)) if counters[i]]
+        ttable = ast.literal_eval(data.decode())
+    except (OSError, SyntaxError, ValueError, IndexError, UnicodeError):
+        return []
+    return sorted(wd * 1440 + h * 60 + m for wd, h, m, s, cnt in ttable)
+class EventStore():
+    """
+    Columnar store of the events of one board
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.state = {"offset": 0, "inode": None, "events": 0}
+        try:
+            with open(os.path.join(path, STATE_FILENAME), "r") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            pass
+    def _column(self, name):
+        return os.path.join(self.path, name + ".bin")
+    def reset(self):
+        """
+        Drops the events (the timetable and the slot drift are kept)
+        """
+        for name, tc in COLUMNS:
+            open(self._column(name), "wb").close()
+        self.state.update({"offset": 0, "inode": None, "events": 0})
+    def _truncate(self, events):
+        """
+        Drops the events appended after the last saved state (interrupted run)
+        """
+        for name, tc in COLUMNS:
+            with open(self._column(name), "ab") as f:
+                f.truncate(events * array.array(tc).itemsize)
+    def save(self):
+        name = os.path.join(self.path, STATE_FILENAME)
+        with open(name + ".tmp", "w") as f:
+            json.dump(self.state, f)
+        os.replace(name + ".tmp", name) # Atomic
+    def ingest(self, log, chunk=4096):
+        """
+        Parses all complete lines appended to log since the last call
+        Returns the number of new events
+        """
+        try:
+            st = os.stat(log)
+        except OSError:
+            return 0
+        if st.st_ino != self.state["inode"] or st.st_size < self.state["offset"] \
+                or "events" not in self.state:
+            # New or truncated log (or store of an old version): start over
+            self.reset()
+            self.state["inode"] = st.st_ino
+        else:
+            self._truncate(self.state["events"])
+        cols = [array.array(tc) for name, tc in COLUMNS]
+        new_events = 0
+        offset = self.state["offset"]
+        with open(log, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break # Incomplete line: wait for the rest
+                offset += len(line)
+                event = parse_line(line)
+                if event is None:
+                    continue
+                for col, value in zip(cols, event):
+                    col.append(value)
+                new_events += 1
+                if len(cols[0]) >= chunk:
+                    self._append(cols, offset)
+        self._append(cols, offset)
+        return new_events
+    def _append(self, cols, offset):
+        """
+        Appends the events to the columns and saves the state with the offset
+        of the log up to which they were parsed
+        """
+        self.state["events"] += len(cols[0])
+        for (name, tc), col in zip(COLUMNS, cols):
+            with open(self._column(name), "ab") as f:
+                col.tofile(f)
+            del col[:]
+        self.state["offset"] = offset
+        self.save()
+    def columns(self):
+        """
+        Returns memoryviews of the memory mapped columns (ts, ev)
+        """
+        views = []
+        for name, tc in COLUMNS:
+            try:
+                with open(self._column(name), "rb") as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        views.append(memoryview(array.array(tc)))
+                        continue
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except OSError:
+                views.append(memoryview(array.array(tc)))
+                continue
+            views.append(memoryview(mm).cast(tc))
+        return views
+class Stats():
+    """
+    Statistics of one board (or of the whole fleet)
+    """
+    def __init__(self, name):
+        self.name = name
+        self.demand = array.array("i", [0]) * WEEK_MINUTES # Heatmap by minute of the week
+        self.pump_starts = 0
+        self.runtime = 0 # s
+        self.slots_added = 0
+        self.slots_moved = 0
+        self.slots_removed = 0
+        self.drift = 0 # Sum of the absolute shift of moved slots (min)
+    def add(self, other):
+        for i in range(WEEK_MINUTES):
+            self.demand[i] += other.demand[i]
+        self.pump_starts += other.pump_starts
+        self.runtime += other.runtime
+        self.slots_added += other.slots_added
+        self.slots_moved += other.slots_moved
+        self.slots_removed += other.slots_removed
+        self.drift += other.drift
+    def evaluate(self, ts, ev):
+        """
+        Evaluates the event columns
+        """
+        pump_on = None
+        for i in range(len(ts)):
+            e = ev[i]
+            if e == EV_DEMAND:
+                self.demand[minute_of_week(ts[i])] += 1
+            elif e == EV_PUMP_ON:
+                pump_on = ts[i]
+                self.pump_starts += 1
+            elif e == EV_PUMP_OFF and pump_on is not None:
+                self.runtime += ts[i] - pump_on
+                pump_on = None
+    def slot_drift(self, old, new):
+        """
+        Compares two timetables (lists of minutes of the week).
+        Slots which vanished and a new slot within 60 min on the same day are counted as moved
+        """
+        added = [m for m in new if m not in old]
+        removed = [m for m in old if m not in new]
+        for m in added:
+            near = [r for r in removed if r // 1440 == m // 1440 and abs(r - m) <= 60]
+            if near:
+                r = min(near, key=lambda r: abs(r - m))
+                removed.remove(r)
+                self.slots_moved += 1
+                self.drift += abs(r - m)
+            else:
+                self.slots_added += 1
+        self.slots_removed += len(removed)
+    def write_heatmap(self, name):
+        """
+        Writes the demand heatmap as csv (only minutes with demand)
+        """
+        with open(name, "w") as f:
+            f.write("minute_of_week,slot,demand\n")
+            for i in range(WEEK_MINUTES):
+                if self.demand[i]:
+                    f.write(f"{i},{format_minute(i)},{self.demand[i]}\n")
+    def summary(self):
+        moved = f"{self.drift / self.slots_moved:.1f}" if self.slots_moved else "-"
+        return f"{self.name:20} demands:{sum(self.demand):6} starts:{self.pump_starts:6} " \
+               f"runtime:{self.runtime / 3600:8.1f}h slots +{self.slots_added} -{self.slots_removed} " \
+               f"~{self.slots_moved} (mean drift {moved} min)"
+def process_board(board_dir, store):
+    """
+    Worker: ingest new log lines of one board and evaluate them
+    """
+    name = board_name(board_dir)
+    path = os.path.join(store, name)
+    events = EventStore(path)
+    events.ingest(os.path.join(board_dir, LOG_FILENAME))
+    stats = Stats(name)
+    stats.evaluate(*events.columns())
+    # Learned slot drift: summed up over all runs in the state of the store
+    stats.slots_added, stats.slots_moved, stats.slots_removed, stats.drift = \
+        events.state.get("slots", (0, 0, 0, 0))
+    new = read_timetable(os.path.join(board_dir, TIMETABLE_FILENAME))
+    if new: # A missing timetable file is no drift
+        if "timetable" in events.state:
+            stats.slot_drift(events.state["timetable"], new)
+        events.state["timetable"] = new
+        events.state["slots"] = [stats.slots_added, stats.slots_moved, stats.slots_removed, stats.drift]
+        events.save()
+    stats.write_heatmap(os.path.join(path, "heatmap.csv"))
+    return stats
+def board_name(board_dir):
+    return os.path.basename(os.path.normpath(board_dir))
+def main(argv):
+    if len(argv) < 3:
+        print("Usage: python3 fleetstats.py STORE BOARD_DIR [BOARD_DIR ...]")
+        return 1
+    store, boards = argv[1], argv[2:]
+    names = [board_name(board) for board in boards]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        # The name is the directory of the board in the store
+        print(f"Board names must be unique: {', '.join(duplicates)}")
+        return 1
+    os.makedirs(store, exist_ok=True)
+    fleet = Stats(FLEET_NAME)
+    with ProcessPoolExecutor() as pool:
+        for stats in pool.map(process_board, boards, [store] * len(boards)):
+            print(stats.summary())
+            fleet.add(stats)
+    fleet.write_heatmap(os.path.join(store, "fleet_heatmap.csv"))
+    print(fleet.summary())
+    return 0
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -17,7 +17,7 @@
 from machine import Pin
 from neopixel import NeoPixel # We have a ws2812rgb LED
 from time import sleep_ms
-from ulogging import info, debug
+from ulogging import info, debug, getLogger, DEBUG
 import timetable
 # GPIO-Pin für WS2812 RGB Led
 PIN_NP = 23
@@ -52,9 +52,11 @@ class RGB_led(Singleton):
     def set(self,color, led = 0):
         """
         Set the color of one led (default index = 0)
+        Nothing is written if the color does not change
         """
-        if self.status[led] != color:
-            info(f"{timetable.pt()}: RGB_Led: Set {led} to {color}")
+        if self.status[led] == color:
+            return
+        info(f"{timetable.pt()}: RGB_Led: Set {led} to {color}")
         self.np[led] = color
         self.np.write()
         self.status[led] = color
@@ -64,11 +66,11 @@ class RGB_led(Singleton):
         Blink all LEDs with color. Ensure that we set the LEDs off before and after and 
         restore their previous color at the end
         """
-        debug(f"{timetable.pt()}: RGB_Led: Binking {num} for {ms}ms with color {color}")
+        if getLogger(None).isEnabledFor(DEBUG): # Do not build the string in steady state
+            debug(f"{timetable.pt()}: RGB_Led: Binking {num} for {ms}ms with color {color}")
         for i in range(num):
-            # Set Leds off, but keep status
+            # Set Leds off, status keeps the current colors
             for j in range(self.leds):
-                self.status[j] = self.np[j]
                 self.np[j] = self.off
             self.np.write()
             sleep_ms(ms)
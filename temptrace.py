@@ -0,0 +1,216 @@
+#
+# This file is part of the wwpump distribution
+# Copyright (c) 2022 Martin Köhler.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Temperature trace
+# The samples (time in s, temperature in 1/16 °C) are stored in pages of PAGE_SIZE bytes in TRACE_FILENAME.
+# When all pages are used the oldest page is overwritten.
+# Page: header (magic, number of words, time and temperature of the first sample) followed by 16 bit words
+# word: 6 bit time delta (s) | 10 bit signed temperature delta to the previous sample
+# If a delta does not fit: ESCAPE followed by time delta (2 words) and absolute temperature (1 word)
+#
+# Host side: python3 temptrace.py FILE [--raw] prints the samples as csv (FILE from export() or the raw
+# TRACE_FILENAME with --raw)
+TRACE_FILENAME = "trace.bin"
+EXPORT_FILENAME = "trace.blob"
+PAGE_SIZE = 4096
+PAGES = 64 # 256kB
+INTERVAL = 60 # (s) Record a sample every INTERVAL s ...
+FULL_TIME = 5*60 # (s) ... but every sample for FULL_TIME s after an event
+PAGE_MAGIC = b"TR"
+HEADER_SIZE = 10 # magic, n (u16), t0 (u32), temp0 (i16)
+ESCAPE = 0x0000
+import time
+from ulogging import info, debug
+from My_time import my_time
+# Helper functions
+# ======================================
+def _put(buf, pos, value):
+    """
+    Store 16 bit little endian without allocating memory
+    """
+    buf[pos] = value & 0xff
+    buf[pos + 1] = (value >> 8) & 0xff
+def _get(buf, pos, signed=False):
+    value = buf[pos] | buf[pos + 1] << 8
+    if signed and value & 0x8000:
+        value -= 0x10000
+    return value
+def decode(data, page_size=0):
+    """
+    Returns the samples [(time, temperature in 1/16 °C)] of an exported blob
+    (or of the raw trace file if page_size is given) sorted by time
+    """
+    pages = []
+    pos = 0
+    while pos + HEADER_SIZE <= len(data):
+        if data[pos:pos + 2] != PAGE_MAGIC:
+            if page_size: # Unused page
+                pos += page_size
+                continue
+            break
+        n = _get(data, pos + 2)
+        t = _get(data, pos + 4) | _get(data, pos + 6) << 16
+        temp = _get(data, pos + 8, signed=True)
+        samples = [(t, temp)]
+        i = pos + HEADER_SIZE
+        end = i + 2 * n
+        while i < end:
+            word = _get(data, i)
+            i += 2
+            if word == ESCAPE:
+                t += _get(data, i) | _get(data, i + 2) << 16
+                temp = _get(data, i + 4, signed=True)
+                i += 6
+            else:
+                t += word >> 10
+                delta = word & 0x3ff
+                temp += delta - 0x400 if delta & 0x200 else delta
+            samples.append((t, temp))
+        pages.append(samples)
+        pos = pos + page_size if page_size else end
+    pages.sort(key=lambda page: page[0][0])
+    return [sample for page in pages for sample in page]
+class Trace():
+    """
+    Records temperature samples in flash (see above)
+    """
+    def __init__(self, name=TRACE_FILENAME, pages=PAGES, interval=INTERVAL, full_time=FULL_TIME):
+        self.name = name
+        self.pages = pages
+        self.interval = interval
+        self.full_time = full_time
+        self.buf = bytearray(PAGE_SIZE) # Current page
+        self.pos = 0 # 0: page empty
+        self.full_until = 0
+        self.last_time = 0
+        self.last_temp = 0
+        self.page = (self._newest_page() + 1) % pages # Do not overwrite the newest page
+    def event(self, t=None, temps=None, times=None, cnt=0):
+        """
+        Record every sample for full_time s (e.g. rising temperature)
+        temps, times: ring buffer of the recent samples (newest at cnt). The older ones
+        are recorded as well, if they were dropped by the downsampling
+        """
+        if t == None:
+            t = my_time()
+        self.full_until = t + self.full_time
+        if temps is None:
+            return
+        n = len(temps)
+        for i in range(1, n): # Oldest first, the newest is added by the caller
+            j = (cnt + i) % n
+            if times[j] > self.last_time:
+                self.add(temps[j], times[j])
+    def add(self, temp, t=None):
+        """
+        Add a sample (temperature in 1/16 °C)
+        """
+        if t == None:
+            t = my_time()
+        dt = t - self.last_time
+        if self.pos and (dt < 1 or (dt < self.interval and t > self.full_until)):
+            return # Downsampling
+        dtemp = temp - self.last_temp
+        if self.pos == 0:
+            self._start(t, temp)
+        elif dt < 64 and -512 <= dtemp < 512:
+            if self.pos + 2 > PAGE_SIZE:
+                self._next_page(t, temp)
+            else:
+                _put(self.buf, self.pos, dt << 10 | (dtemp & 0x3ff))
+                self.pos += 2
+        else:
+            if self.pos + 8 > PAGE_SIZE:
+                self._next_page(t, temp)
+            else:
+                _put(self.buf, self.pos, ESCAPE)
+                _put(self.buf, self.pos + 2, dt & 0xffff)
+                _put(self.buf, self.pos + 4, dt >> 16)
+                _put(self.buf, self.pos + 6, temp & 0xffff)
+                self.pos += 8
+        self.last_time = t
+        self.last_temp = temp
+    def flush(self):
+        """
+        Write the current page to flash
+        """
+        if self.pos == 0:
+            return
+        _put(self.buf, 2, (self.pos - HEADER_SIZE) // 2)
+        try:
+            f = open(self.name, "r+b")
+        except OSError: # New file
+            f = open(self.name, "wb")
+        with f:
+            f.seek(self.page * PAGE_SIZE)
+            f.write(self.buf)
+        debug(f"Trace page {self.page} written to {self.name}")
+    def export(self, name=EXPORT_FILENAME):
+        """
+        Write all pages without the unused space as one blob (see decode)
+        """
+        self.flush()
+        o = 0
+        page = bytearray(PAGE_SIZE)
+        with open(self.name, "rb") as f, open(name, "wb") as out:
+            for i in range(self.pages):
+                f.seek(i * PAGE_SIZE)
+                if f.readinto(page) < HEADER_SIZE or page[0:2] != PAGE_MAGIC:
+                    continue
+                o += out.write(memoryview(page)[0:HEADER_SIZE + 2 * _get(page, 2)])
+        info(f"Trace: {o} Bytes written to {name}")
+        return o
+    def _start(self, t, temp):
+        self.buf[0:2] = PAGE_MAGIC
+        _put(self.buf, 2, 0)
+        _put(self.buf, 4, t & 0xffff)
+        _put(self.buf, 6, (t >> 16) & 0xffff)
+        _put(self.buf, 8, temp & 0xffff)
+        self.pos = HEADER_SIZE
+    def _next_page(self, t, temp):
+        self.flush()
+        self.page = (self.page + 1) % self.pages # Rollover
+        self._start(t, temp)
+    def _newest_page(self):
+        """
+        Returns the page with the newest samples in the file (-1 if there is none)
+        """
+        newest = -1
+        newest_time = -1
+        header = bytearray(HEADER_SIZE)
+        try:
+            with open(self.name, "rb") as f:
+                for i in range(self.pages):
+                    f.seek(i * PAGE_SIZE)
+                    if f.readinto(header) < HEADER_SIZE:
+                        break
+                    t = _get(header, 4) | _get(header, 6) << 16
+                    if header[0:2] == PAGE_MAGIC and t > newest_time:
+                        newest, newest_time = i, t
+        except OSError:
+            pass
+        return newest
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python3 temptrace.py FILE [--raw]")
+        sys.exit(1)
+    with open(sys.argv[1], "rb") as f:
+        data = f.read()
+    print("time,temperature")
+    for t, temp in decode(data, PAGE_SIZE if "--raw" in sys.argv else 0):
+        y, mm, d, h, m, s = time.gmtime(t)[0:6] # Board time without time zone
+        print(f"{d:02d}.{mm:02d}.{y} {h:02d}:{m:02d}:{s:02d},{temp / 16}")
@@ -28,36 +28,55 @@ backup = Backup(pumpe, stream)
 # Start processes
 alarm_timer = Alarm_timer()
 print("Testing")
+def rise_temperature():
+    Temp().t = array.array("h", [15 * 16] * 5) # 15°C in 1/16 °C
+    # Without slots the temperature is only sampled every IDLE_SAMPLE_TICKS (see sample_now),
+    # the checks below expect a sample every tick
+    pumpe.last_rise = pumpe.now
 # Test cases
 time.sleep(3)
 # rise temperature
 print("Rise temperature")
-Temp().t = [15.0] * 5
+rise_temperature()
 time.sleep(5)
 # Must now have one timetable entry
-print(f"Timetable with one entry {ttable.timetable}")
+print(f"Timetable with one entry {ttable.slots()}")
 print(f"Next alert: {timetable.pt(my_time() + ttable.next_alarm())}")
 print(f"...but no schedduled run (False): {alarm_timer.timer3_time}")
 time.sleep(11)
 print(f"Pump should be off now (False): {pumpe.pumpe_laeuft}")
 # Inside quiet time!
 print("Rising temp inside quiet time: No slot, no pumping")
-Temp().t = [15.0] * 5
+rise_temperature()
 time.sleep(5)
 print(f"Inside waiting time (10,0,0): {pumpe.rgb_led.status}")
 print("Rising temp inside waiting time")
-Temp().t = [15.0] * 5
+rise_temperature()
 # Must now have one timetable entry
-print(f"{ttable.timetable} should have counter added")
+print(f"{ttable.slots()} should have counter added")
 print(f"Not in holiday mode (False): {pumpe.holiday}")
 time.sleep(90)
 print(f"Should be in holiday mode (True): {pumpe.holiday}")
 print(f"No next scheduled run (False): {alarm_timer.timer3_time}")
 print(f"Outside waiting time(0,0,0,0): {pumpe.rgb_led.status}")
 print("Rising Temp")
-Temp().t = [15.0] * 5
+rise_temperature()
 time.sleep(3)
 print(f"Pumpe läuft (True): {pumpe.pumpe_laeuft}")
 time.sleep(5)
 print(f"Desinfect should have run")
 print(f"Next scheduled run {timetable.pt(alarm_timer.timer3_time)}")
+# Allocation free tick
+print("Steady state ticks must not allocate memory")
+alarm_timer.stop()
+pumpe.tick() # Settle LED and state
+gc.collect()
+Temp().gc_mark = gc.mem_alloc() + GC_IDLE_ALLOC # No collection inside the loop
+mem = gc.mem_alloc()
+changed = 0
+for i in range(3000):
+    pumpe.tick()
+    if gc.mem_alloc() != mem:
+        changed += 1
+        mem = gc.mem_alloc()
+print(f"Ticks with allocation (0): {changed}")
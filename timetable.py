@@ -15,8 +15,16 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 # Timetable
-SLOT_TIME = 15 # (in min) slots are 15 minutes (Slots must divide the hour!)
+SLOT_TIME = 15 # (in min) slots are 15 minutes (1 ... 60, Slots must divide the hour!)
 TIMETABLE_FILENAME = "timetable"
+TIMETABLE_MAGIC = b"TT2" # File format: magic, slot_time, day types, one counter byte per template slot
+TIMETABLE_MAGIC_V1 = b"TT1" # Old format: magic, slot_time, one counter byte per slot of the week
+WEEK_MINUTES = 7 * 24 * 60
+MAX_COUNTER = 255 # Counters are stored in one byte
+# Day types: template used for every weekday (Mon ... Sun). Days with the same template share their
+# slots, e.g. (0, 0, 0, 0, 0, 1, 2) for weekdays, Saturday, Sunday. Per day overrides get their own
+# template, e.g. (0, 0, 0, 0, 1, 2, 3) for a Friday different from Mon ... Thu
+DAY_TYPES = (0, 1, 2, 3, 4, 5, 6) # Every day its own template
 from ulogging import info, debug
 import time
 from My_time import my_time
@@ -34,12 +42,43 @@ class Timetable():
     """
     Implements a timetable to store the slots where we turn the pump on
     """
-    # timetable is an array that stores tuples [wday,hour,min,cnt], where cnt is a counter,
-    # which ensures that entries are deleted if not used
-    timetable = [] # Leere Tabelle
+    # counters is a bytearray with one counter for every slot of the day for every template
+    # (day type). The counter ensures that entries are deleted if not used (0 == no entry).
+    # A slot of the week (Mon 00:00 is slot 0) is resolved through day_types to its counter.
+    # hours stores the number of used slots per hour of every template to speed up the search
     slot_time = SLOT_TIME
-    def __init__(self):
+    def __init__(self, slot_time=SLOT_TIME, day_types=DAY_TYPES):
+        if slot_time < 1 or 60 % slot_time:
+            raise ValueError(f"Slot time {slot_time} does not divide the hour")
+        if len(day_types) != 7 or min(day_types) < 0:
+            raise ValueError(f"Day types {day_types} need a template >= 0 for every weekday")
+        self.slot_time = slot_time
+        self.slots_per_hour = 60 // slot_time
+        self.slots_per_day = 24 * self.slots_per_hour
+        self.week_slots = 7 * self.slots_per_day
+        self.day_types = bytes(day_types)
+        self.templates = max(day_types) + 1
+        self.clear()
         self.read_fromdisk() # If we have a timetable on disk, read it
+    def clear(self):
+        """
+        Remove all slots
+        """
+        self.counters = bytearray(self.templates * self.slots_per_day)
+        self.hours = bytearray(self.templates * 24)
+        self.entries = 0
+        self.runs = None # Cached plan
+        self.runs_cooldown = 0
+    def __len__(self):
+        """
+        Number of used (template) slots
+        """
+        return self.entries
+    def slots(self):
+        """
+        Returns the used slots of the week as list of [wday, h, m, s, cnt]
+        """
+        return [self._to_slot(i) for i in self._used()]
     def check_item(self, t = None, increase = True):
         """
         If we get a new item, we search whether this falls in an already existing slot
@@ -49,34 +88,77 @@ class Timetable():
         if t == None:
             t = my_time()
         index = self._in_timetable(t)
-        if index == None:
+        cnt = self.counters[self._counter(index)]
+        if not cnt:
             if increase: # Do not add a slot if increase == False e.g. scheduled_run
                 self._add_slot(t)
             return
-        # Already in the table or no new slot -> handle counter (wday,h,m,s,cnt]
+        # Already in the table or no new slot -> handle counter
         if increase:
-            self.timetable[index][4] += 1
-            info(f"{pt()}: Slot found. Counter increased {self._format_slot(self.timetable[index])}")
+            if cnt < MAX_COUNTER:
+                self.counters[self._counter(index)] = cnt + 1
+            info(f"{pt()}: Slot found. Counter increased {self._format_slot(index)}")
         else:
-            self.timetable[index][4] -= 1
-            info(f"{pt()}: Slot found. Counter decreased {self._format_slot(self.timetable[index])}")
-            if self.timetable[index][4] < 1:
-                self.timetable.pop(index)
-                debug("Entry removed")
-    def next_alarm(self,t = None):
+            self._decrease(index)
+    def check_run(self, t, cooldown):
+        """
+        Decrease the counters of all slots served by a planned run (see plan) at t:
+        the slot of t and the following slots starting within cooldown s
+        """
+        index = self._in_timetable(t)
+        slot_seconds = self.slot_time * 60
+        for k in range(max(1, -(-cooldown // slot_seconds))): # Round up
+            i = (index + k) % self.week_slots
+            if self.counters[self._counter(i)]:
+                self._decrease(i)
+    def plan(self, cooldown):
+        """
+        Coalesce the slots into planned runs: a slot starting less than cooldown s after
+        the last run finds the pipe still warm and needs no run of its own.
+        Returns the sorted start times of the runs (s since Monday 00:00)
+        """
+        if self.runs != None and self.runs_cooldown == cooldown:
+            return self.runs
+        week = WEEK_MINUTES * 60
+        slot_seconds = self.slot_time * 60
+        warm_until = -1
+        # The second pass takes into account that runs at the end of the week cover the beginning
+        for p in range(2):
+            runs = []
+            for i in self._used():
+                start = i * slot_seconds
+                if start < warm_until:
+                    continue
+                runs.append(start)
+                warm_until = start + cooldown
+            warm_until -= week
+        if not runs and self.entries:
+            runs.append(next(self._used()) * slot_seconds) # cooldown longer than a week
+        self.runs = runs
+        self.runs_cooldown = cooldown
+        debug(f"{pt()}: {len(runs)} runs planned for {self.entries} slots")
+        return runs
+    def next_alarm(self,t = None, cooldown = None):
         """
         Returns next alarm time in s from t (or my_time() == now)
         or False if no entry in the timetable
+        If cooldown (s) is given, the next run of the plan is used instead of the next slot
         """
         if t == None:
             t = my_time()
-        week = 7 * 24 * 60 * 60 # One week in seconds
-        if len(self.timetable) < 1:
+        week = WEEK_MINUTES * 60 # One week in seconds
+        if self.entries < 1:
             return False
-        index = self._next_slot(t)
-        slot_wd, slot_h, slot_m, slot_s = self.timetable[index][0:-1] # We do not need the counter here
-        slot_base_time = self._to_base_time([slot_h, slot_m, slot_s, slot_wd])
-        base_time = self._to_base_time(time.localtime(t)[3:7])
+        base_time = self._to_base_time(t)
+        if cooldown == None:
+            slot_base_time = self._next_slot(t) * self.slot_time * 60
+        else:
+            runs = self.plan(cooldown)
+            slot_base_time = runs[0]
+            for run in runs:
+                if run > base_time:
+                    slot_base_time = run
+                    break
         if slot_base_time <= base_time:
             return slot_base_time + week - base_time
         else:
@@ -85,95 +167,163 @@ class Timetable():
         """
         store the timetable on disk
         """
-        if len(self.timetable) < 1:
+        if self.entries < 1:
             debug("No data in timetable to write")
             return False
-        with open(name, "w") as f:
-            o=f.write(str(self.timetable))
+        with open(name, "wb") as f:
+            o=f.write(TIMETABLE_MAGIC)
+            o+=f.write(bytes((self.slot_time,)))
+            o+=f.write(self.day_types)
+            o+=f.write(self.counters)
             debug(f"{o} Bytes written to {name}")
             return True
     def read_fromdisk(self, name=TIMETABLE_FILENAME):
         """
         Reads a timetable from disk and initializes the local variable
+        Timetables stored with other slot time or day types or in an old format
+        (list of [wday,h,m,s,cnt]) are converted
         """
         try:
-            with open(name,"r") as f:
-                o = t_table = f.read()
-                debug(f"{o} Bytes read from {name}")
-            self.timetable = eval(t_table)
-            info(f"{len(self.timetable)} entries read from {name}")
+            with open(name,"rb") as f:
+                t_table = f.read()
+                debug(f"{len(t_table)} Bytes read from {name}")
+            data = None
+            if t_table.startswith(TIMETABLE_MAGIC):
+                slot_time = t_table[len(TIMETABLE_MAGIC)]
+                day_types = t_table[len(TIMETABLE_MAGIC) + 1:len(TIMETABLE_MAGIC) + 8]
+                data = t_table[len(TIMETABLE_MAGIC) + 8:]
+            elif t_table.startswith(TIMETABLE_MAGIC_V1):
+                slot_time = t_table[len(TIMETABLE_MAGIC_V1)]
+                day_types = bytes(range(7))
+                data = t_table[len(TIMETABLE_MAGIC_V1) + 1:]
+            if data != None and (slot_time < 1 or 60 % slot_time or len(day_types) != 7):
+                raise ValueError("Corrupt header") # Ignored like other file errors
+            if data == None:
+                items = [((wd * 24 + h) * 60 + m, cnt) for wd, h, m, s, cnt in eval(t_table.decode())]
+            elif slot_time == self.slot_time and day_types == self.day_types and len(data) == len(self.counters):
+                items = None
+            else:
+                # Expand the templates of the file to the week
+                spd = 1440 // slot_time
+                items = [(wd * 1440 + i * slot_time, data[day_types[wd] * spd + i])
+                         for wd in range(7) for i in range(spd) if data[day_types[wd] * spd + i]]
         except OSError:
             debug(f"{pt()}: No file {name} found.")
             return False
-        except SyntaxError:
+        except (SyntaxError, ValueError, IndexError, TypeError):
             debug(f"{pt()}: SyntaxError in {name}. Ignoring")
             return False
+        self.clear()
+        if items == None:
+            # Same layout: take the counters as they are
+            self.counters[:] = data
+            sph = self.slots_per_hour
+            for h in range(len(self.hours)):
+                used = 0
+                for i in range(h * sph, h * sph + sph): # bytearray has no count() in MicroPython
+                    if self.counters[i]:
+                        used += 1
+                self.hours[h] = used
+                self.entries += used
+        for minute, cnt in items or []:
+            index = self._counter(minute % WEEK_MINUTES // self.slot_time)
+            self._set_counter(index, max(self.counters[index], min(cnt, MAX_COUNTER)))
+        info(f"{self.entries} entries read from {name}")
         return True
+    def _counter(self, index):
+        """
+        Returns the index of the counter (in the template) for a slot of the week
+        """
+        spd = self.slots_per_day
+        return self.day_types[index // spd] * spd + index % spd
+    def _decrease(self, index):
+        """
+        Decrease the counter of a used slot of the week and remove it if it reaches 0
+        """
+        cnt = self.counters[self._counter(index)] - 1
+        self._set_counter(self._counter(index), cnt)
+        info(f"{pt()}: Slot found. Counter decreased {self._format_slot(index)}")
+        if cnt < 1:
+            debug("Entry removed")
+    def _set_counter(self, index, cnt):
+        """
+        Set the counter (index in the templates) and keep track of the used slots
+        """
+        hour = index // self.slots_per_hour
+        if self.counters[index] and not cnt:
+            self.entries -= 1
+            self.hours[hour] -= 1
+            self.runs = None # Plan changes
+        elif cnt and not self.counters[index]:
+            self.entries += 1
+            self.hours[hour] += 1
+            self.runs = None
+        self.counters[index] = cnt
+    def _used(self):
+        """
+        Generates the indices of the used slots of the week in order
+        """
+        sph = self.slots_per_hour
+        for h in range(7 * 24):
+            if self.hours[self.day_types[h // 24] * 24 + h % 24]:
+                for i in range(h * sph, h * sph + sph):
+                    if self.counters[self._counter(i)]:
+                        yield i
     def _add_slot(self, t):
         """
-        Add an item to the timetable and sort the table
+        Add an item to the timetable
         Return True in case less than two entries remain
         """
-        h, m, s, wd = time.localtime(t)[3:7]
-        # Force Slots
-        slot_m = m // self.slot_time * self.slot_time
-        m = slot_m
-        s = 0
+        index = self._in_timetable(t)
         cnt = 1 # Remove after one week
-        slot = [wd,h,m,s,cnt]
-        info(f"{pt()}: Adding Slot {self._format_slot(slot)}")
-        self.timetable.append(slot)
-        # Sort the table using all entries 0 padded
-        self.timetable.sort(key=lambda elem: "".join([f"{i:02}" for i in elem]))
-        if len(self.timetable) < 2:
+        self._set_counter(self._counter(index), cnt)
+        info(f"{pt()}: Adding Slot {self._format_slot(index)}")
+        if self.entries < 2:
             # Probably need to schedule next alarm
             return True
         return False
-    def _format_slot(self, slot):
+    def _to_slot(self, index):
+        """
+        Converts a slot index of the week to [wday, h, m, s, cnt]
+        """
+        minute = index * self.slot_time
+        return [minute // 1440, minute % 1440 // 60, minute % 60, 0, self.counters[self._counter(index)]]
+    def _format_slot(self, index):
         """
         Human readable form of a slot
         """
         days = ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
+        slot = self._to_slot(index)
         return f"'{days[slot[0]]}: {slot[1]:02}:{slot[2]:02}:{slot[3]:02} Counter:{slot[4]}'"
-    def _to_base_time(self, lst):
+    def _to_base_time(self, t):
         """
-        converts a list [h,m,s,wd] to base in 1970 to ensure that we can substract
+        converts a time t to seconds since Monday 00:00:00 to ensure that we can substract
         """
-        h, m, s, wd = lst
-        base_date = (1970, 1, 5 + wd, h, m, s, 0, 0, 0) #  (1970, 1, 5, 0, 0, 0, 0, 0, 0)
-        #print(base_date)
-        base_time = time.mktime(base_date)
-        return base_time
+        h, m, s, wd = time.localtime(t)[3:7]
+        return ((wd * 24 + h) * 60 + m) * 60 + s
     def _next_slot(self, t):
         """
-        Find the next slot for a given time t
-        We assume the timetable is sorted!
-        returns index or false if timetable empty
+        Find the next slot of the week for a given time t (a slot starting at t is returned, too)
+        returns index or False if timetable empty
         """
-        h, m, s, wd = time.localtime(t)[3:7]
-        slot_str = "".join(f"{i:02}" for i in [wd,h,m,s]) # The last 0 is a dummy
-        # Create auxiliary table just containing zero padded strings form the first 4 slot elements,
-        # e.g. without the counter
-        timetable_str = [ "".join([f"{i:02}" for i in elem[0:-1]]) for elem in self.timetable]
-        for i in range(0, len(timetable_str)):
-            if timetable_str[i] < slot_str:
+        if self.entries < 1:
+            return False
+        slot_seconds = self.slot_time * 60
+        index = -(-self._to_base_time(t) // slot_seconds) % self.week_slots # Round up
+        sph = self.slots_per_hour
+        hour = index // sph
+        # Skip the unused hours. The last pass checks the beginning of the first hour
+        for k in range(7 * 24 + 1):
+            h = (hour + k) % (7 * 24)
+            if not self.hours[self.day_types[h // 24] * 24 + h % 24]:
                 continue
-            return i
-        # If there are entries in the timetable, wrap around
-        if len(timetable_str) > 0:
-            return 0 # First element
+            start = index if k == 0 else h * sph
+            for i in range(start, h * sph + sph):
+                if self.counters[self._counter(i)]:
+                    return i
         return False
     def _in_timetable(self, t):
         """
-        Check wether time is in the timetable
-        returns timetable index or None
-        """
-        local_base_time = self._to_base_time(time.localtime(t)[3:7])
-        for i in range(0,len(self.timetable)):
-            wday, hour, min, sec = self.timetable[i][0:-1]
-            base_time = self._to_base_time([hour,min,sec,wday])
-            max_time = base_time + self.slot_time * 60
-            min_time = base_time
-            if min_time <= local_base_time <= max_time:
-                return i
-        return None
+        Returns the index of the slot of the week containing time t
+        """
+        return self._to_base_time(t) // (self.slot_time * 60) % self.week_slots
@@ -15,62 +15,105 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 import micropython, onewire, ds18x20
-import sys, io, time
+import sys, io, time, gc, array
+from micropython import const
 import ulogging
 import timetable
+import temptrace
 from machine import Timer
 from machine import Pin
 from led import Led, RGB_led, Singleton
 from ulogging import info, debug
 from My_time import my_time
 # DS18B20
-DS18B20_PIN = 22
-DS18B20_INDEX = 0 # Only one sensor
+DS18B20_PIN = const(22)
+DS18B20_INDEX = const(0) # Only one sensor
+CONVERSION_TIME = const(800) # (ms) Warten: min. 750 ms
+RISING_DELTA = const(4) # (1/16 °C) Rising temperature 0.25°
 # Pumpe
-PUMPEN_PIN = 20
+PUMPEN_PIN = const(20)
 # Heartbeat (ms)
-TICK_TIME = 1000 # Main routine
+TICK_TIME = const(1000) # Main routine
 # All thess times are in s
+# No const(): tests.py shortens them, const() values are compiled into the code
 WAITING_TIME = 15*60 # Pump should only run every 15 minutes
 RUNNING_TIME = 40 # Pump runs for 40 seconds
 QUIET_TIME = RUNNING_TIME + 20 # Rising temperatgure will be ignored in QUIET_TIME
 HOLIDAY_TIME = 24 * 60 * 60 # Holiday mode if no request for 24h
 DESINFECT_TIME = 3*24*60*60 # Run pump at least every 3 days & do Backup
+# Lead time: Scheduled runs start the learned time (per hour of the day) the warm water needs
+# to reach the sensor before the slot. Starts with RUNNING_TIME. The warm up is only measured while
+# the pump runs, the lead time is at most RUNNING_TIME (otherwise the pump stops before the slot)
+LEAD_TIME_MARGIN = const(5) # Added to the learned lead time
+# Scheduled runs are skipped if the pipe is still warm, i.e. above the middle between the learned
+# temperatures of the cold pipe (start of a scheduled run) and the warm pipe (maximum while pumping)
+WARM_DELTA_MIN = const(2*16) # (1/16 °C) Minimum difference of warm and cold to use it
+# Cool down: learned time from pump start until the pipe is below that threshold again.
+# Slots within this time after a scheduled run are served by the same run
+COOLDOWN_TIME = const(30*60) # Until learned
+COOLDOWN_MAX = const(3*60*60)
+# Demand within WAITING_TIME is served when the waiting time ends, if it or the last rising
+# temperature (water still drawn) is younger than PENDING_TIME
+PENDING_TIME = const(5*60)
+# Adaptive sampling: the temperature is measured every tick DEMAND_WINDOW around the slots of the
+# timetable and for ACTIVE_TIME after a rising temperature (or while the pump is active),
+# otherwise only every IDLE_SAMPLE_TICKS (HOLIDAY_SAMPLE_TICKS in holiday mode)
+DEMAND_WINDOW = const(30*60)
+ACTIVE_TIME = const(10*60)
+IDLE_SAMPLE_TICKS = const(10)
+HOLIDAY_SAMPLE_TICKS = const(60)
+# Garbage collection (bytes): collect in the idle window of the temperature conversion
+# if more than GC_IDLE_ALLOC bytes were allocated since the last collection
+GC_IDLE_ALLOC = const(4096)
 # USR Button
-USR_PIN = 13
+USR_PIN = const(13)
 # Backup
 LOG_FILENAME = "wwpumpe.log"
+TRACE = False # Record the temperature trace (see temptrace.py)
 class Alarm_timer():
-    timer3 = Timer()
+    timer3 = Timer() # Reused for every scheduled run
     def __init__(self, pumpe):
         self.pumpe=pumpe
         self.ttable = self.pumpe.ttable
         self.pumpe_tick_ref=pumpe.tick
         self.pumpe_desinfect_ref=self.pumpe_desinfect
         self.pumpe_scheduled_run_ref = self.pumpe_scheduled_run
+        self.cb3_ref = self._cb3
+        self.lead = RUNNING_TIME # Lead time (s) of the next scheduled run
+        self.cooldown = 0 # Cool down (s) used for the plan
         self.timer1= Timer(period=TICK_TIME, mode=Timer.PERIODIC, callback=self._cb1) # Worker
         self.timer2=Timer(period= DESINFECT_TIME * 1000, mode=Timer.PERIODIC, callback=self._cb2) # Alle 3 Tage
         # Make sure we initialize the alarm scheduler (timer3)
         self.schedule_next_alarm(self.ttable)
-    def schedule_next_alarm(self, ttable):
-        alrm = ttable.next_alarm() # This is in seconds
+    def schedule_next_alarm(self, ttable, after=0):
+        """
+        Program timer3 for the next run of the plan that starts more than after s from now
+        """
+        self.cooldown = self.pumpe.cooldown()
+        alrm = ttable.next_alarm(my_time() + after, cooldown=self.cooldown) # This is in seconds
+        if alrm != False:
+            alrm += after
         self.timer3.deinit() # Just to be on the safe side
         if alrm == False:
             info(f"{timetable.pt()}: No next alarm scheduled")
             self.timer3_time = False
             return
-        # Start QUIT_TIME seconds earlier to ensure that a periodic request near a slot boundary is handled 
-        # correctly. If request is always at 8:15:01, the pump is started so that the next request at 8:15:01 
-        # is recognized as a Warm water request, which means it must be after the QUIET_TIME
-        if alrm > QUIET_TIME:
+        # Start the learned lead time earlier, so that the water is warm at the beginning of the slot.
+        # The rising temperature of the scheduled run is ignored up to the slot, hence a periodic request
+        # at 8:15:01 is still recognized as a Warm water request
+        self.lead = self.pumpe.lead_time(my_time() + alrm)
+        if alrm > self.lead:
             # Ensure that alrm remains > 0
-            alrm -= QUIET_TIME
-        self.timer3 = Timer(period=alrm*1000, mode=Timer.ONE_SHOT, callback=self._cb3) # need ms here
+            alrm -= self.lead
+        else:
+            self.lead = 0
+        self.timer3.init(period=alrm*1000, mode=Timer.ONE_SHOT, callback=self.cb3_ref) # need ms here
         self.timer3_time = my_time()+alrm # Store this in the class
         info(f"{timetable.pt()}: Next scheduled_run at: {timetable.pt(self.timer3_time)}")
     def pumpe_scheduled_run(self, args=None):
-        self.pumpe.scheduled_run()
-        self.schedule_next_alarm(self.ttable)
+        self.pumpe.scheduled_run(lead=self.lead, cooldown=self.cooldown)
+        # Plan from the start of this run's slot on, otherwise the same run is found again
+        self.schedule_next_alarm(self.ttable, after=self.lead + 1)
     def pumpe_desinfect(self, args=None):
         # If we do not have a next alarm scheduled, check whether there is a new
         # entry in the timetable
@@ -100,8 +143,12 @@ class Temp(Singleton):
     """
     Temperature class:
     Stores the last temperatures and checks for rising temperature
+    Temperatures are kept as int in 1/16 °C (raw value of the DS18B20), so that
+    a measurement does not allocate memory
     """
     cnt = 0
+    gc_mark = 0 # Collect garbage if gc.mem_alloc() exceeds this
+    recorder = None # Optional temptrace.Trace
     led_onboard = Led() # On board led
     def __init__(self):
         try:
@@ -113,15 +160,23 @@ class Temp(Singleton):
             self.rom = False
             class ds():
                 temp = 22.0
+                raw = 22 * 16 # 1/16 °C
+                buf = bytearray(2) # Like the scratch pad buffer of the driver
                 def convert_temp(self):
                     return
                 def read_temp(self, rom):
                     return self.temp
+                def read_scratch(self, rom):
+                    self.buf[0] = self.raw & 0xff
+                    self.buf[1] = (self.raw >> 8) & 0xff
+                    return self.buf
                 def set_temp(self,value):
                     self.temp = value
+                    self.raw = int(value * 16)
             self.ds = ds()
         temp_now = self._get_temperature()
-        self.t = [temp_now] * 5 # Initialize history
+        self.t = array.array("h", [temp_now] * 5) # Initialize history
+        self.times = array.array("L", [0] * 5) # Times (s) of the history, only kept for the recorder
 
     def rising(self):
         """
@@ -134,17 +189,52 @@ class Temp(Singleton):
         cnt_alt  = (self.cnt + 2) % 5 # 5 measuremenzs earlier
         temperatur_delta = self.t[self.cnt]-self.t[cnt_alt]; # Temperaturdifferenz der letzten
                                                              # 5 Messzyklen bzw. Sekunden
-        if (temperatur_delta >= 0.25): # 0.16°
-            info(f"{timetable.pt()}: Rising temperature: {temperature}")
+        if self.recorder:
+            now = my_time()
+            self.times[self.cnt] = now
+            if temperatur_delta >= RISING_DELTA:
+                # Record the full rate around the event, starting with the history
+                self.recorder.event(now, self.t, self.times, self.cnt)
+            self.recorder.add(temperature, now)
+        if (temperatur_delta >= RISING_DELTA): # 0.16°
+            info(f"{timetable.pt()}: Rising temperature: {temperature / 16}")
             self.led_onboard.blink(num=2)
             return True
         return False
 
+    def minimum(self):
+        """
+        Returns the lowest of the last temperatures in 1/16 °C
+        """
+        return min(self.t)
+
+    def current(self):
+        """
+        Returns the last measured temperature in 1/16 °C
+        """
+        return self.t[self.cnt]
+
     def _get_temperature(self):
+        """
+        Returns the temperature in 1/16 °C
+        """
         self.ds.convert_temp()
+        start = time.ticks_ms()
+        # The conversion is done by the sensor. Neither OneWire nor NeoPixel timing is running,
+        # hence this is the place for the garbage collection
+        if gc.mem_alloc() > self.gc_mark:
+            gc.collect()
+            self.gc_mark = gc.mem_alloc() + GC_IDLE_ALLOC
         # Warten: min. 750 ms
-        time.sleep_ms(800)
-        return self.ds.read_temp(self.rom)
+        wait = CONVERSION_TIME - time.ticks_diff(time.ticks_ms(), start)
+        if wait > 0 and self.rom: # The mock up needs no conversion time
+            time.sleep_ms(wait)
+        # read_scratch reads into a preallocated buffer, read_temp would return a float
+        buf = self.ds.read_scratch(self.rom)
+        t = buf[1] << 8 | buf[0]
+        if t & 0x8000: # negative
+            t -= 0x10000
+        return t
 
 class Pumpe():
     holiday = False
@@ -156,21 +246,42 @@ class Pumpe():
         self.led_onboard = Led()
         self.pumpenpin = Pin(PUMPEN_PIN, Pin.OUT)
         self.pumpenpin.on() # Low -> Pumpe ein
-        self.now = my_time()
+        # self.now and all times of the state are seconds since boot (see clock)
+        self.now = 1 # 0 (False) means "not set" for some times
+        self.clock_ms = 0
+        self.last_ticks = time.ticks_ms()
         self.last_pumpenstart = self.now - WAITING_TIME
         self.rgb_led.set(RGB_led.off)
         self.last_scheduled_run = self.now - (WAITING_TIME + QUIET_TIME)
+        self.scheduled_run_end = self.last_scheduled_run + QUIET_TIME # Rising temperature is ignored until
         self.last_warm_water_demand = self.now - QUIET_TIME
+        # Learned time (s) from pump start until the warm water reaches the sensor per hour of the day
+        self.lead_times = array.array("H", [RUNNING_TIME] * 24)
+        self.warmup_start = False # Pump start of the running measurement
+        self.warmup_temp = 0
+        self.warmup_hour = 0
+        # Learned temperatures (1/16 °C) of the cold and warm pipe
+        self.cold_temp = None
+        self.warm_temp = None
+        self.peak_temp = None # Maximum while the pump runs
+        self.cooldown_time = COOLDOWN_TIME
+        self.cooldown_start = False # Pump start of the running measurement
+        self.last_rise = self.now - ACTIVE_TIME
+        self.pending_demand = False # Time of a demand within the waiting time
+        self.sample_cnt = 0 # Ticks since the last measurement
+        self.sampling_from = 0 # Next demand window
+        self.sampling_until = 0
         self.outside_waiting_time = True
         self.outside_quiet_time= True
         self.outside_scheduled_run = True
         self.sanitycheck_failed = False
 
-    def laeuft(self, pumpe_soll_laufen):
+    def laeuft(self, pumpe_soll_laufen, defer=False):
         """
         What shall the pump do?
         If it should run (True) than we check whether this request was given outside the waiting time,
-        in which case the pump will start and we return true.
+        in which case the pump will start and we return true. With defer a request within the waiting
+        time is kept and served when the waiting time ends.
         If we the pump should not run (False), we check whether the running time has elaped
         and stop the pump in that case. We always return False.
         """
@@ -181,6 +292,11 @@ class Pumpe():
                 self.pumpenpin.off()
                 info(f"{timetable.pt()}: Pump on")
                 self.last_pumpenstart = self.now
+                self.cooldown_start = False
+                self.pending_demand = False
+            elif defer:
+                info(f"{timetable.pt()}: Request within waiting time. (pump starts after waiting time)")
+                self.pending_demand = self.now
             else:
                 info(f"{timetable.pt()}: Request within waiting time. (pump stays 'off')")
             return True
@@ -191,13 +307,32 @@ class Pumpe():
             self.pumpe_laeuft = False
             self.pumpenpin.on()
             info(f"{timetable.pt()}: Pump off")
+            if self.peak_temp is not None:
+                self.warm_temp = self._learn(self.warm_temp, self.peak_temp)
+                self.peak_temp = None
+            threshold = self.warm_threshold()
+            if threshold is not None and self.temp.current() >= threshold:
+                self.cooldown_start = self.last_pumpenstart
         return False # request False or trigger ignored
 
+    def clock(self):
+        """
+        Updates and returns self.now (s since boot). Unlike my_time() (1970 epoch) this
+        stays a small int, hence the tick does not allocate memory
+        """
+        ms = time.ticks_ms()
+        self.clock_ms += time.ticks_diff(ms, self.last_ticks)
+        self.last_ticks = ms
+        if self.clock_ms >= 1000:
+            self.now += self.clock_ms // 1000
+            self.clock_ms %= 1000
+        return self.now
+
     def update_state(self):
         """
         Updates internal state variables
         """
-        self.now = my_time()
+        self.clock()
         # Check sanity
         sanitycheck_failed = False 
         if self.last_pumpenstart > self.now:
@@ -208,9 +343,18 @@ class Pumpe():
             sanitycheck_failed = True
         if self.last_scheduled_run > self.now:
             self.last_scheduled_run = self.now
+            self.scheduled_run_end = self.now
+            self.warmup_start = False
+            sanitycheck_failed = True
+        if self.last_rise > self.now:
+            self.last_rise = self.now
+            sanitycheck_failed = True
+        if self.pending_demand and self.pending_demand > self.now:
+            self.pending_demand = self.now
             sanitycheck_failed = True
         if sanitycheck_failed:
             self.sanity_failed = my_time()
+            self.sampling_until = 0 # Plan the demand window again
 
         # Set current status (waiting, quiet time, ...)
         if self.last_pumpenstart + WAITING_TIME < self.now:
@@ -218,6 +362,7 @@ class Pumpe():
                 info(f"{timetable.pt()}: Now outside waiting time")
             self.outside_waiting_time= True
             self.rgb_led.set(RGB_led.off)
+            self.start_pending() # Request from the waiting time
         else:
             # indicate that pump can not be triggered in waiting time
             if self.outside_waiting_time:
@@ -246,7 +391,7 @@ class Pumpe():
                 info(f"{timetable.pt()}: Leaving holiday mode")
             self.holiday = False
 
-        if self.last_scheduled_run + QUIET_TIME < self.now:
+        if self.scheduled_run_end < self.now and not self.warmup_start:
             if not self.outside_scheduled_run:
                 info(f"{timetable.pt()}: Outside scheduled run")
             self.outside_scheduled_run = True
@@ -255,8 +400,44 @@ class Pumpe():
                 info(f"{timetable.pt()}: Scheduled run")
             self.outside_scheduled_run = False
 
+    def sample_now(self):
+        """
+        Returns True if the temperature should be measured in this tick
+        """
+        self.sample_cnt += 1
+        if self.now > self.sampling_until:
+            self.plan_sampling()
+        if self.pumpe_laeuft or self.warmup_start \
+            or not self.outside_quiet_time \
+            or not self.outside_scheduled_run \
+            or self.now - self.last_rise < ACTIVE_TIME \
+            or (not self.holiday and self.sampling_from <= self.now) \
+            or self.sample_cnt >= (HOLIDAY_SAMPLE_TICKS if self.holiday else IDLE_SAMPLE_TICKS):
+            self.sample_cnt = 0
+            return True
+        return False
+
+    def plan_sampling(self):
+        """
+        Find the next demand window (around the next slot of the timetable)
+        """
+        alrm = self.ttable.next_alarm()
+        if alrm == False:
+            # No slot: check again later
+            self.sampling_until = self.now + DEMAND_WINDOW
+            self.sampling_from = self.sampling_until + 1
+            return
+        self.sampling_from = self.now + alrm - DEMAND_WINDOW
+        self.sampling_until = self.now + alrm + self.ttable.slot_time * 60 + DEMAND_WINDOW
+        debug(f"{timetable.pt()}: Demand window {timetable.pt(my_time() + alrm - DEMAND_WINDOW)}")
+
     def warm_water_demand(self):
-        if self.temp.rising() \
+        if not self.sample_now():
+            return False
+        rising = self.temp.rising()
+        if rising:
+            self.last_rise = self.now # Sample every tick for a while
+        if rising \
             and self.outside_quiet_time \
             and self.outside_scheduled_run:
             # Real demand
@@ -264,6 +445,99 @@ class Pumpe():
             return True
         return False
 
+    def lead_time(self, t):
+        """
+        Time (s) the pump has to start before t to provide warm water at t
+        """
+        return min(self.lead_times[time.localtime(t)[3]] + LEAD_TIME_MARGIN, RUNNING_TIME)
+
+    def measure_warmup(self):
+        """
+        Measure the time from the start of a scheduled run until the temperature rises
+        and update the lead time of that hour
+        """
+        if not self.warmup_start:
+            return
+        warmup = self.now - self.warmup_start
+        if not self.pumpe_laeuft:
+            # Pump stopped before the temperature rose: nothing learned
+            info(f"{timetable.pt()}: No warm up within {warmup}s")
+            self.warmup_start = False
+            return
+        if self.temp.current() - self.warmup_temp >= RISING_DELTA:
+            # Pipe was cold at the start
+            self.cold_temp = self._learn(self.cold_temp, self.warmup_temp)
+            hour = self.warmup_hour
+            self.lead_times[hour] = (3 * self.lead_times[hour] + warmup) // 4
+            self.warmup_start = False
+            # Ignore the rising temperature of this run for some more seconds
+            self.scheduled_run_end = max(self.scheduled_run_end, self.now + LEAD_TIME_MARGIN)
+            info(f"{timetable.pt()}: Warm up took {warmup}s. Lead time {hour}h: {self.lead_times[hour]}s")
+
+    def start_pending(self):
+        """
+        Start the pump for a demand that came within the waiting time if it is still fresh
+        """
+        if not self.pending_demand:
+            return
+        age = self.now - self.pending_demand
+        if self.now - max(self.pending_demand, self.last_rise) <= PENDING_TIME:
+            info(f"{timetable.pt()}: Serving request from {age}s ago")
+            self.laeuft(True)
+        else:
+            info(f"{timetable.pt()}: Dropping request from {age}s ago")
+        self.pending_demand = False
+
+    def warm_threshold(self):
+        """
+        Returns the temperature between cold and warm pipe or None if not learned yet
+        """
+        if self.cold_temp is None or self.warm_temp is None \
+            or self.warm_temp - self.cold_temp < WARM_DELTA_MIN:
+            return None
+        return (self.cold_temp + self.warm_temp) // 2
+
+    def pipe_warm(self):
+        """
+        Returns True if all recent temperatures are above the learned threshold
+        between cold and warm pipe
+        """
+        threshold = self.warm_threshold()
+        if threshold is None:
+            return False # Not learned yet
+        return self.temp.minimum() >= threshold
+
+    def cooldown(self):
+        """
+        Time (s) a run keeps the pipe warm. Runs within WAITING_TIME are not possible
+        """
+        return max(self.cooldown_time, WAITING_TIME)
+
+    def measure_cooldown(self):
+        """
+        Measure the time from pump start until the pipe is cold again
+        """
+        if not self.cooldown_start:
+            return
+        threshold = self.warm_threshold()
+        if threshold is None:
+            # Learned temperatures changed (e.g. by a warm up): no valid measurement
+            self.cooldown_start = False
+            return
+        cooldown = self.now - self.cooldown_start
+        if self.temp.current() < threshold or cooldown >= COOLDOWN_MAX:
+            self.cooldown_time = self._learn(self.cooldown_time, min(cooldown, COOLDOWN_MAX))
+            self.cooldown_start = False
+            info(f"{timetable.pt()}: Cool down took {cooldown}s. Cool down time: {self.cooldown_time}s")
+
+    def _learn(self, old, value):
+        """
+        Running estimate of a temperature
+        """
+        if old is None:
+            return value
+        return (3 * old + value) // 4
+
     def tick(self, args=None):
         """
         Periodic task
@@ -273,37 +547,54 @@ class Pumpe():
         if self.warm_water_demand():
             info(f"{timetable.pt()}: Warm water request detected")
             # Request pump on
-            # Pump stays off during waiting time!
-            self.laeuft(True)
+            # During waiting time the pump starts when it ends
+            self.laeuft(True, defer=True)
             self.ttable.check_item()  # Mark this in the timetable
+            self.sampling_until = 0 # The timetable may have a new slot
         else:
             self.laeuft(False)                    # request pump off
+        self.measure_warmup()
+        self.measure_cooldown()
+        if self.pumpe_laeuft and (self.peak_temp is None or self.temp.current() > self.peak_temp):
+            self.peak_temp = self.temp.current()
         self.led_onboard.blink(ms=10) # Heartbeat (Should run at the end)
 
-    def scheduled_run(self, args=None):
+    def scheduled_run(self, args=None, lead=QUIET_TIME, cooldown=0):
         """
         Starte pumpe gemäß timetable
+        lead (s) is the time until the slot begins, the run serves all slots within cooldown (s)
         """
-        self.last_scheduled_run = my_time() # Can not use self.now here
+        self.last_scheduled_run = self.clock() # self.now is updated here
+        self.scheduled_run_end = self.last_scheduled_run + lead
         self.update_state() # Needs valod self.last_scheduled_run
         if self.holiday:
             # If on holiday skip scheduled runs
             info(f"{timetable.pt()}: Holiday: skipping scheduled run")
             return
         info(f"{timetable.pt()}: Scheduled run")
-        # Decrease the counter in the timetable
+        # Decrease the counters of the served slots in the timetable
         slot_buffer = 2 # Security buffer (s) to ensure we are inside the right slot (not at the border)
-        self.ttable.check_item(t=my_time() + QUIET_TIME + slot_buffer, increase=False)
+        self.ttable.check_run(my_time() + lead + slot_buffer, cooldown)
+        # The slot is counted as served anyway, since the warm pipe is the result of a recent demand
+        if self.pipe_warm():
+            info(f"{timetable.pt()}: Pipe still warm ({self.temp.current() / 16}): skipping scheduled run")
+            return
         self.laeuft(True)
+        if self.pumpe_laeuft and self.last_pumpenstart == self.now:
+            # Pump started from cold: measure the warm up
+            self.warmup_start = self.now
+            self.warmup_temp = self.temp.current()
+            self.warmup_hour = time.localtime(my_time() + lead)[3] # Hour of the slot (see lead_time)
 
     def desinfect(self, args=None): # Start pump (every 72h) if no timetable exists
         """
         Start pump for desinfection during holiday and initialize next scheduled 
         run after e.g. timetable was empty
         """
-        if (len(self.ttable.timetable) < 1 or self.holiday):
+        if (len(self.ttable) < 1 or self.holiday):
             # Treat this as a scheduled run
-            self.last_scheduled_run = my_time()
+            self.last_scheduled_run = self.clock()
+            self.scheduled_run_end = self.last_scheduled_run + QUIET_TIME
             self.update_state()
             # No entry in timetable
             info(f"{timetable.pt()}: Desinfect run")
@@ -312,6 +603,8 @@ class Pumpe():
         # Backup timetable
         info(f"{timetable.pt()}: Backup timetable")
         self.ttable.write_todisk()
+        if self.temp.recorder:
+            self.temp.recorder.flush()
 
 class Backup():
     timestamp = 0
@@ -346,6 +639,9 @@ class Backup():
                         o=f.write(msgs)
                         debug(f"{o} Bytes written to {LOG_FILENAME}")
                         self.pumpe.rgb_led.blink(RGB_led.green, num=2)
+            # Export the temperature trace
+            if self.pumpe.temp.recorder:
+                self.pumpe.temp.recorder.export()
             self.timestamp = now
 # Logger
 stream = sys.stdout
@@ -353,6 +649,8 @@ stream = sys.stdout
 ulogging.basicConfig(stream=stream) # INFO
 #ulogging.basicConfig(level=ulogging.DEBUG,stream=stream)
 pumpe=Pumpe()
+if TRACE:
+    pumpe.temp.recorder = temptrace.Trace()
 # Prepare for backup via USR button
 backup = Backup(pumpe, stream)
 # Start processes